@@ -6,19 +6,27 @@
 #  https://github.com/zhovner/mfdread
 
 
-import codecs
-import copy
 import sys
 from datetime import datetime, timedelta
-from collections import defaultdict
 
-from bitstring import BitArray
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 
 class Options:
     FORCE_1K = False
     UID_LENGTH = 4
 
+# Computed once at import time so batch runs do not query the clock per dump
+_CURRENT_YEAR_2DIGIT = datetime.now().year - 2000
+
 if len(sys.argv) == 1:
     sys.exit('''
 ------------------
@@ -27,11 +35,10 @@ Mifare dumps reader.
 ''')
 
 
-def decode(bytes):
-    decoded = codecs.decode(bytes, "hex")
+def decode(s):
     try:
-        return str(decoded, "utf-8").rstrip(b'\0')
-    except:
+        return bytes.fromhex(s).decode('utf-8', 'ignore').rstrip('\x00')
+    except ValueError:
         return ""
 
 
@@ -43,101 +50,166 @@ class bashcolors:
     ENDC = '\033[0m'
 
 
-def accbits_for_blocknum(accbits_str, blocknum):
-    '''
-    Decodes the access bit string for block "blocknum".
-    Returns the three access bits for the block or False if the
-    inverted bits do not match the access bits.
-    '''
-    bits = BitArray([0])
-    inverted = BitArray([0])
-
-    # Block 0 access bits
-    if blocknum == 0:
-        bits = BitArray([accbits_str[11], accbits_str[23], accbits_str[19]])
-        inverted = BitArray([accbits_str[7], accbits_str[3], accbits_str[15]])
-
-    # Block 0 access bits
-    elif blocknum == 1:
-        bits = BitArray([accbits_str[10], accbits_str[22], accbits_str[18]])
-        inverted = BitArray([accbits_str[6], accbits_str[2], accbits_str[14]])
-    # Block 0 access bits
-    elif blocknum == 2:
-        bits = BitArray([accbits_str[9], accbits_str[21], accbits_str[17]])
-        inverted = BitArray([accbits_str[5], accbits_str[1], accbits_str[13]])
-    # Sector trailer / Block 3 access bits
-    elif blocknum in (3, 15):
-        bits = BitArray([accbits_str[8], accbits_str[20], accbits_str[16]])
-        inverted = BitArray([accbits_str[4], accbits_str[0], accbits_str[12]])
+def _paint_colored(color, s):
+    return color + s + bashcolors.ENDC
+
+
+def _paint_plain(color, s):
+    return s
+
+# Swapped for _paint_plain in -n mode so no empty codes get concatenated
+paint = _paint_colored
+
+
+# Shift amounts of the three access bits (C1 C2 C3) and their inverted
+# counterparts inside the 24-bit access field, per block number
+_ACC_SHIFTS = {
+    0: (12, 0, 4, 16, 20, 8),
+    1: (13, 1, 5, 17, 21, 9),
+    2: (14, 2, 6, 18, 22, 10),
+    3: (15, 3, 7, 19, 23, 11),
+    15: (15, 3, 7, 19, 23, 11),
+}
+
+
+def _decode_accbits(accbits, shifts):
+    s0, s1, s2, i0, i1, i2 = shifts
+    bits = ((accbits >> s0) & 1) << 2 | ((accbits >> s1) & 1) << 1 | ((accbits >> s2) & 1)
+    inverted = ((accbits >> i0) & 1) << 2 | ((accbits >> i1) & 1) << 1 | ((accbits >> i2) & 1)
 
     # Check the decoded bits
-    inverted.invert()
-    if bits.bin == inverted.bin:
-        return bits
+    if bits ^ inverted == 0b111:
+        return f"{bits:03b}"
     else:
         return False
 
 
+def accbits_for_blocknum(accbits, blocknum):
+    '''
+    Decodes the access bits of block "blocknum" from the 24-bit access field.
+    Returns the three access bits as a string like "010" or False if the
+    inverted bits do not match the access bits.
+    '''
+    shifts = _ACC_SHIFTS.get(blocknum)
+    if shifts is None:
+        return False
+    return _decode_accbits(accbits, shifts)
+
+
+_PERM_SECTOR_DICT = {
+    '000': "- A | A   - | A A [read B]",
+    '010': "- - | A   - | A - [read B]",
+    '100': "- B | A/B - | - B",
+    '110': "- - | A/B - | - -",
+    '001': "- A | A   A | A A [transport]",
+    '011': "- B | A/B B | - B",
+    '101': "- - | A/B B | - -",
+    '111': "- - | A/B - | - -",
+}
+
+_PERM_DATA_DICT = {
+    '000': "A/B | A/B   | A/B | A/B [transport]",
+    '010': "A/B |  -    |  -  |  -  [r/w]",
+    '100': "A/B |   B   |  -  |  -  [r/w]",
+    '110': "A/B |   B   |   B | A/B [value]",
+    '001': "A/B |  -    |  -  | A/B [value]",
+    '011': "  B |   B   |  -  |  -  [r/w]",
+    '101': "  B |  -    |  -  |  -  [r/w]",
+    '111': " -  |  -    |  -  |  -  [r/w]",
+}
+
+
 def accbits_to_permission_sector(accbits):
-    permissions = {
-        '000': "- A | A   - | A A [read B]",
-        '010': "- - | A   - | A - [read B]",
-        '100': "- B | A/B - | - B",
-        '110': "- - | A/B - | - -",
-        '001': "- A | A   A | A A [transport]",
-        '011': "- B | A/B B | - B",
-        '101': "- - | A/B B | - -",
-        '111': "- - | A/B - | - -",
-    }
-    if isinstance(accbits, BitArray):
-        return permissions.get(accbits.bin, "unknown")
+    if isinstance(accbits, str):
+        return _PERM_SECTOR_DICT.get(accbits, "unknown")
     else:
         return ""
 
 
 def accbits_to_permission_data(accbits):
-    permissions = {
-        '000': "A/B | A/B   | A/B | A/B [transport]",
-        '010': "A/B |  -    |  -  |  -  [r/w]",
-        '100': "A/B |   B   |  -  |  -  [r/w]",
-        '110': "A/B |   B   |   B | A/B [value]",
-        '001': "A/B |  -    |  -  | A/B [value]",
-        '011': "  B |   B   |  -  |  -  [r/w]",
-        '101': "  B |  -    |  -  |  -  [r/w]",
-        '111': " -  |  -    |  -  |  -  [r/w]",
-    }
-    if isinstance(accbits, BitArray):
-        return permissions.get(accbits.bin, "unknown")
+    if isinstance(accbits, str):
+        return _PERM_DATA_DICT.get(accbits, "unknown")
     else:
         return ""
 
 
 def accbit_info(accbits, sector_size):
     '''
-    Returns  a dictionary of a access bits for all three blocks in a sector.
+    Returns a list of the access bits of all blocks in a sector, indexed by block number.
     If the access bits for block could not be decoded properly, the value is set to False.
     '''
-    access_bits = defaultdict(lambda: False)
-
     if sector_size == 15:
-        access_bits[sector_size] = accbits_for_blocknum(accbits, sector_size)
+        access_bits = [False] * 16
+        access_bits[15] = _decode_accbits(accbits, _ACC_SHIFTS[15])
         return access_bits
 
-    # Decode access bits for all 4 blocks of the sector
-    for i in range(0, 4):
-        access_bits[i] = accbits_for_blocknum(accbits, i)
-    return access_bits
+    # Decode access bits for all 4 blocks of the sector in one pass
+    return [_decode_accbits(accbits, _ACC_SHIFTS[i]) for i in range(4)]
 
 def is_value_block(block):
     b = bytes.fromhex(block)
-    return  (b[0] == b[8] and (b[0] ^ 0xFF) == b[4]) and \
-            (b[1] == b[9] and (b[1] ^ 0xFF) == b[5]) and \
-            (b[2] == b[10] and (b[2] ^ 0xFF) == b[6]) and \
-            (b[3] == b[11] and (b[3] ^ 0xFF) == b[7]) and \
-            (b[12] == b[14] and b[13] == b[15] and \
-            (b[12] ^ 0xFF) == b[13])
-
-def print_info(data):
+    value = int.from_bytes(b[0:4], 'little')
+    # Ordinary data blocks bail out on the first int compare
+    if value != int.from_bytes(b[8:12], 'little'):
+        return False
+    if (value ^ int.from_bytes(b[4:8], 'little')) != 0xFFFFFFFF:
+        return False
+    return b[12] == b[14] and b[13] == b[15] and (b[12] ^ 0xFF) == b[13]
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _scan_value_blocks(buf):
+        out = np.zeros(buf.shape[0], dtype=np.bool_)
+        for i in range(buf.shape[0]):
+            ok = buf[i, 12] == buf[i, 14] and buf[i, 13] == buf[i, 15] and \
+                 (buf[i, 12] ^ 0xFF) == buf[i, 13]
+            for j in range(4):
+                if not ok:
+                    break
+                ok = buf[i, j] == buf[i, j + 8] and (buf[i, j] ^ 0xFF) == buf[i, j + 4]
+            out[i] = ok
+        return out
+
+
+def value_block_mask(data):
+    '''
+    Returns an array with one bool per 16-byte block marking the value
+    blocks, or None if numpy is not available.
+    '''
+    if np is None:
+        return None
+    buf = np.frombuffer(data, dtype=np.uint8).reshape(-1, 16)
+    # The compiled scan pays off when many dumps are processed in one run
+    if njit is not None:
+        return _scan_value_blocks(buf)
+    return ((buf[:, 0:4] == buf[:, 8:12]).all(1)
+            & ((buf[:, 0:4] ^ 0xFF) == buf[:, 4:8]).all(1)
+            & (buf[:, 12] == buf[:, 14]) & (buf[:, 13] == buf[:, 15])
+            & ((buf[:, 12] ^ 0xFF) == buf[:, 13]))
+
+# Static table furniture, built once instead of per print call
+_TABLE_TOP = "\n".join((
+    "╔═════════╦═══════╦══════════════════════════════════╦════════╦═════════════════════════════════════╗",
+    "║  Sector ║ Block ║            Data                  ║ Access ║   A | Acc.  | B                     ║",
+    "║         ║       ║                                  ║        ║ r w | r   w | r w [info]            ║",
+    "║         ║       ║                                  ║        ║  r  |  w    |  i  | d/t/r           ║",
+))
+_SEP = "╠═════════╬═══════╬══════════════════════════════════╬════════╬═════════════════════════════════════╣"
+_TABLE_BOTTOM = "╚═════════╩═══════╩══════════════════════════════════╩════════╩═════════════════════════════════════╝"
+
+# Sector start offsets for the three dump layouts.
+# After the first 32 sectors of a 4K dump each sector has 16 blocks instead of 4.
+_OFFSETS_320 = tuple(range(0, 320, 64))
+_OFFSETS_1K = tuple(range(0, 1024, 64))
+_OFFSETS_4K = tuple(range(0, 2048, 64)) + tuple(range(2048, 4096, 256))
+
+
+def iter_dump_lines(data):
+    '''
+    Parses the dump and yields the report line by line, leaving the
+    buffering strategy to the caller.
+    '''
     blocksmatrix = []
     blockrights = {}
     block_number = 0
@@ -145,104 +217,100 @@ def print_info(data):
     data_size = len(data)
 
     if data_size not in {4096, 1024, 320}:
-        sys.exit("Wrong file size: %d bytes.\nOnly 320, 1024 or 4096 bytes allowed." % len(data))
+        sys.exit(f"Wrong file size: {data_size} bytes.\nOnly 320, 1024 or 4096 bytes allowed.")
 
     if Options.FORCE_1K:
         data_size = 1024
 
+    if data_size == 320:
+        offsets = _OFFSETS_320
+    elif data_size == 1024:
+        offsets = _OFFSETS_1K
+    else:
+        offsets = _OFFSETS_4K
+
     # read all sectors
-    sector_number = 0
-    start = 0
-    end = 64
-    while True:
-        sector = data[start:end]
-        sector = codecs.encode(sector, 'hex')
-        if not isinstance(sector, str):
-            sector = str(sector, 'ascii')
+    for start in offsets:
+        sector = data[start:start + (64 if start < 2048 else 256)].hex()
         sectors = [sector[x:x + 32] for x in range(0, len(sector), 32)]
 
         blocksmatrix.append(sectors)
 
-        # after 32 sectors each sector has 16 blocks instead of 4
-        sector_number += 1
-        if sector_number < 32:
-            start += 64
-            end += 64
-        elif sector_number == 32:
-            start += 64
-            end += 256
-        else:
-            start += 256
-            end += 256
+    sector_number = len(offsets)
 
-        if start == data_size:
-            break
+    # Shallow copy is enough: the block strings are immutable and only the
+    # list entries of blocksmatrix get replaced by colored versions below
+    blocksmatrix_clear = [row[:] for row in blocksmatrix]
 
-    blocksmatrix_clear = copy.deepcopy(blocksmatrix)
+    # One vectorized pass over the whole dump instead of per-block checks
+    valmask = value_block_mask(data[:data_size])
+
+    # Bind the colors to locals to avoid attribute lookups in the loops
+    RED = bashcolors.RED
+    GREEN = bashcolors.GREEN
+    BLUE = bashcolors.BLUE
+    WARNING = bashcolors.WARNING
+    ENDC = bashcolors.ENDC
 
     # add colors for each keyA, access bits, KeyB
     for c in range(0, len(blocksmatrix)):
         sector_size = len(blocksmatrix[c]) - 1
 
+        trailer = blocksmatrix[c][sector_size]
+        keyA, accbits_hex, keyB = trailer[:12], trailer[12:20], trailer[20:32]
+
         # Fill in the access bits
-        blockrights[c] = accbit_info(BitArray('0x' + blocksmatrix[c][sector_size][12:20]), sector_size)
+        blockrights[c] = accbit_info(int(accbits_hex[:6], 16), sector_size)
 
         # Prepare colored output of the sector trailor
-        keyA = bashcolors.RED + blocksmatrix[c][sector_size][0:12] + bashcolors.ENDC
-        accbits = bashcolors.GREEN + blocksmatrix[c][sector_size][12:20] + bashcolors.ENDC
-        keyB = bashcolors.BLUE + blocksmatrix[c][sector_size][20:32] + bashcolors.ENDC
-
-        blocksmatrix[c][sector_size] = keyA + accbits + keyB
+        blocksmatrix[c][sector_size] = ''.join((paint(RED, keyA),
+                                                paint(GREEN, accbits_hex),
+                                                paint(BLUE, keyB)))
 
     if Options.UID_LENGTH == 4:
         sakStart = Options.UID_LENGTH * 2 + 2
     else:
         sakStart = Options.UID_LENGTH * 2
 
-    print("File size: %d bytes. Expected %d sectors" % (len(data), sector_number))
+    yield f"File size: {len(data)} bytes. Expected {sector_number} sectors"
     if Options.UID_LENGTH == 4:
-        print("\n\tUID:  " + blocksmatrix[0][0][0:8])
+        yield "\n\tUID:  " + blocksmatrix[0][0][0:8]
     else:
-        print("\n\tUID:  " + blocksmatrix[0][0][0:14])
-    print("\tBCC:  " + blocksmatrix[0][0][8:10])
-    print("\tSAK:  " + blocksmatrix[0][0][sakStart:sakStart + 2])
-    print("\tATQA: " + blocksmatrix[0][0][sakStart + 2:sakStart + 6])
+        yield "\n\tUID:  " + blocksmatrix[0][0][0:14]
+    yield "\tBCC:  " + blocksmatrix[0][0][8:10]
+    yield "\tSAK:  " + blocksmatrix[0][0][sakStart:sakStart + 2]
+    yield "\tATQA: " + blocksmatrix[0][0][sakStart + 2:sakStart + 6]
     # Code taken from https://github.com/ikarus23/MifareClassicTool
     try:
         year = int(blocksmatrix_clear[0][0][30:32])
         week = int(blocksmatrix_clear[0][0][28:30])
-        now = datetime.now().year - 2000
-        if year >= 0 and year <= now and week >= 1 and week <= 53:
+        if year >= 0 and year <= _CURRENT_YEAR_2DIGIT and week >= 1 and week <= 53:
             # "fromisocalendar" available only in >= Python 3.8
             try:
                 calendar = datetime.fromisocalendar(year + 2000, week, 1)
                 startDate = calendar.strftime("%d.%m.%Y")
                 endDate = (calendar + timedelta(days=6)).strftime("%d.%m.%Y")
-                print("\tYear of manufacture: Between {} and {}".format(startDate, endDate))
+                yield f"\tYear of manufacture: Between {startDate} and {endDate}"
             except:
                 pass
     except:
         pass
 
-    print("                   %sKey A%s    %sAccess Bits%s    %sKey B%s" % (
-        bashcolors.RED, bashcolors.ENDC, bashcolors.GREEN, bashcolors.ENDC, bashcolors.BLUE, bashcolors.ENDC))
-    print("╔═════════╦═══════╦══════════════════════════════════╦════════╦═════════════════════════════════════╗")
-    print("║  Sector ║ Block ║            Data                  ║ Access ║   A | Acc.  | B                     ║")
-    print("║         ║       ║                                  ║        ║ r w | r   w | r w [info]            ║")
-    print("║         ║       ║                                  ║        ║  r  |  w    |  i  | d/t/r           ║")
+    yield f"                   {RED}Key A{ENDC}    {GREEN}Access Bits{ENDC}    {BLUE}Key B{ENDC}"
+    yield _TABLE_TOP
 
     for q in range(0, len(blocksmatrix)):
-        print("╠═════════╬═══════╬══════════════════════════════════╬════════╬═════════════════════════════════════╣")
+        yield _SEP
         n_blocks = len(blocksmatrix[q])
 
         # z is the block in each sector
         for z in range(0, len(blocksmatrix[q])):
 
             # Format the access bits. Print ERR in case of an error
-            if isinstance(blockrights[q][z], BitArray):
-                accbits = bashcolors.GREEN + blockrights[q][z].bin + bashcolors.ENDC
+            if isinstance(blockrights[q][z], str):
+                accbits = paint(GREEN, blockrights[q][z])
             else:
-                accbits = bashcolors.WARNING + "ERR" + bashcolors.ENDC
+                accbits = paint(WARNING, "ERR")
 
             if q == 0 and z == 0:
                 permissions = "-"
@@ -258,21 +326,24 @@ def print_info(data):
             else:
                 qn = ""
 
-            if is_value_block(blocksmatrix_clear[q][z]):
-                blocksmatrix[q][z] = bashcolors.WARNING + blocksmatrix_clear[q][z] + bashcolors.ENDC
+            if (valmask[block_number] if valmask is not None
+                    else is_value_block(blocksmatrix_clear[q][z])):
+                blocksmatrix[q][z] = paint(WARNING, blocksmatrix_clear[q][z])
 
-            print("║    %-5s║  %-3d  ║ %s ║  %s   ║ %-35s ║ %s" % (qn, block_number, blocksmatrix[q][z],
-                                                                   accbits, permissions,
-                                                                   decode(blocksmatrix_clear[q][z])))
+            yield (f"║    {qn:<5}║  {block_number:<3}  ║ {blocksmatrix[q][z]} ║  {accbits}   "
+                   f"║ {permissions:<35} ║ {decode(blocksmatrix_clear[q][z])}")
 
             block_number += 1
 
-    print("╚═════════╩═══════╩══════════════════════════════════╩════════╩═════════════════════════════════════╝")
+    yield _TABLE_BOTTOM
 
 
 def main(args):
+    global paint
+
     if args[0] == '-n':
         args.pop(0)
+        paint = _paint_plain
         bashcolors.BLUE = ""
         bashcolors.RED = ""
         bashcolors.GREEN = ""
@@ -290,7 +361,7 @@ def main(args):
     filename = args[0]
     with open(filename, "rb") as f:
         data = f.read()
-        print_info(data)
+        sys.stdout.write("\n".join(iter_dump_lines(data)) + "\n")
 
 
 if __name__ == "__main__":